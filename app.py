@@ -7,7 +7,6 @@ This module provides a web interface for the headless browser service.
 import asyncio
 import base64
 import json
-import os
 import sys
 import threading
 import time
@@ -116,7 +115,7 @@ def create_session():
         logger.debug("API call: create_session")
         ensure_browser_started()
         
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         context_id = get_session_id()
         page_id = get_session_id()
         
@@ -124,17 +123,22 @@ def create_session():
         viewport = data.get('viewport', None)
         user_agent = data.get('userAgent', None)
         
+        # Optimized contexts carry init scripts and routes, so they are never pooled
+        optimize = data.get('optimize', False)
+        
         # Create context and page
-        asyncio.run(browser.create_context(context_id, viewport=viewport, user_agent=user_agent))
+        asyncio.run(browser.create_context(context_id, viewport=viewport, user_agent=user_agent,
+                                           reusable=not optimize))
         asyncio.run(browser.create_page(page_id, context_id))
         
         # Apply optimizations if requested
-        if data.get('optimize', False):
+        if optimize:
             page = browser.pages[page_id]
             optimization_options = {
                 'block_resources': data.get('blockResources', []),
                 'viewport': viewport
             }
+            asyncio.run(BrowserOptimizations.apply_context_optimizations(page.context, optimization_options))
             asyncio.run(BrowserOptimizations.apply_all_optimizations(page, optimization_options))
         
         # Store session info
@@ -162,7 +166,7 @@ def close_session():
         
     try:
         logger.debug("API call: close_session")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
         
         if not session_id or session_id not in sessions:
@@ -192,7 +196,7 @@ def navigate():
         
     try:
         logger.debug("API call: navigate")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
         url = data.get('url')
         
@@ -226,9 +230,9 @@ def screenshot():
         
     try:
         logger.debug("API call: screenshot")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
-        full_page = data.get('fullPage', True)
+        full_page = data.get('fullPage', False)
         
         if not session_id or session_id not in sessions:
             logger.warning(f"Invalid session ID: {session_id}")
@@ -257,7 +261,7 @@ def get_content():
         
     try:
         logger.debug("API call: get_content")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
         include_html = data.get('includeHtml', False)
         
@@ -285,7 +289,7 @@ def execute_javascript():
         
     try:
         logger.debug("API call: execute_javascript")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
         script = data.get('script')
         
@@ -317,7 +321,7 @@ def click():
         
     try:
         logger.debug("API call: click")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
         selector = data.get('selector')
         
@@ -351,7 +355,7 @@ def type_text():
         
     try:
         logger.debug("API call: type_text")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
         selector = data.get('selector')
         text = data.get('text')
@@ -385,7 +389,7 @@ def get_element_text():
         
     try:
         logger.debug("API call: get_element_text")
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         session_id = data.get('sessionId')
         selector = data.get('selector')
         
@@ -414,8 +418,5 @@ def run_server(host='0.0.0.0', port=5000):
     app.run(host=host, port=port, debug=False)
 
 if __name__ == '__main__':
-    # Create templates directory if it doesn't exist
-    os.makedirs(os.path.join(os.path.dirname(__file__), 'templates'), exist_ok=True)
-    
     # Run the server
     run_server()
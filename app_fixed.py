@@ -7,25 +7,22 @@ This module provides a web interface for the headless browser service.
 import asyncio
 import base64
 import json
-import os
 import sys
 import threading
 import time
 import uuid
+from functools import wraps
 from typing import Dict, List, Optional, Union
 
-from flask import Flask, request, jsonify, render_template, send_file, Response, make_response
+from flask import Flask, request, render_template, send_file, Response, make_response, stream_with_context
 from flask_cors import CORS
 import logging
-import nest_asyncio
+import orjson
 
 # Import our browser modules
 from browser_core import HeadlessBrowser
 from browser_optimizations import BrowserOptimizations
 
-# Apply nest_asyncio to allow asyncio to work in Flask
-nest_asyncio.apply()
-
 # Create Flask app with CORS support
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -39,31 +36,136 @@ browser = HeadlessBrowser()
 browser_lock = threading.Lock()
 browser_started = False
 
+class Session:
+    """
+    Bookkeeping for an active browser session.
+    
+    Timestamps are integer nanoseconds from time.monotonic_ns().
+    """
+    __slots__ = ('session_id', 'context_id', 'created_at', 'last_used')
+    
+    def __init__(self, session_id, context_id):
+        self.session_id = session_id
+        self.context_id = context_id
+        self.created_at = self.last_used = time.monotonic_ns()
+
 # Store active sessions
-sessions = {}
+sessions: Dict[str, Session] = {}
+
+# Run a single long-lived event loop on a background thread so Playwright's
+# transports stay bound to one loop across all requests
+loop = asyncio.new_event_loop()
+
+def _run_loop():
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+threading.Thread(target=_run_loop, daemon=True).start()
+
+def _run(coro):
+    """Run a coroutine on the browser event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+def ojson(obj, status=200):
+    """Serialize obj with orjson into a JSON response."""
+    return Response(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), status=status,
+                    mimetype="application/json")
+
+def _body():
+    """
+    Parse the request's JSON body with orjson, without caching the raw data.
+    
+    Returns:
+        The body as a dict ({} when there is none), or None if it is not a
+        JSON object
+    """
+    if not request.content_length:
+        return {}
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _invalid_body():
+    """Response for a request body that is not a JSON object."""
+    logger.warning("Invalid JSON body")
+    return ojson({"success": False, "error": "Invalid JSON body"}, 400)
+
+# Image formats accepted by the screenshot endpoints
+_SCREENSHOT_FORMATS = ('jpeg', 'webp')
 
 def get_session_id():
     """Generate a unique session ID."""
     return str(uuid.uuid4())
 
+def require_session(f):
+    """
+    Resolve the request's sessionId to its Session before calling the view.
+    
+    The wrapped view is called as f(session, data) with the parsed JSON body.
+    """
+    @wraps(f)
+    def wrapper():
+        data = _body()
+        if data is None:
+            return _invalid_body()
+        
+        session_id = data.get('sessionId')
+        session = sessions.get(session_id)
+        if session is None:
+            logger.warning(f"Invalid session ID: {session_id}")
+            return ojson({"success": False, "error": "Invalid session ID"}, 400)
+        
+        session.last_used = time.monotonic_ns()
+        return f(session, data)
+    return wrapper
+
 def ensure_browser_started():
     """Ensure the browser is started."""
     global browser_started
     if not browser_started:
         with browser_lock:
             if not browser_started:
-                asyncio.run(browser.start(headless=True))
+                _run(browser.start(headless=True))
                 browser_started = True
 
+def warm_browser():
+    """Start the browser in the background so the first request doesn't wait for it."""
+    def _warm():
+        try:
+            ensure_browser_started()
+        except Exception as e:
+            logger.error(f"Browser warm-up failed: {str(e)}")
+    threading.Thread(target=_warm, daemon=True).start()
+
+# CORS headers added to every API response, built once at import
+_API_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+]
+
+# Answer CORS preflight requests for existing API routes before the views
+# run; any other OPTIONS request gets Flask's normal handling
+@app.before_request
+def handle_preflight():
+    if request.method != 'OPTIONS' or request.path[:5] != '/api/':
+        return None
+    method = request.headers.get('Access-Control-Request-Method')
+    rule = request.url_rule
+    if method and rule is not None and method in rule.methods:
+        return Response(status=204)
+    return None
+
 # Add a middleware to ensure all API responses have proper headers
 @app.after_request
 def add_header(response):
-    if request.path.startswith('/api/'):
-        if not response.headers.get('Content-Type'):
-            response.headers['Content-Type'] = 'application/json'
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    if request.path[:5] == '/api/':
+        response.headers.setdefault('Content-Type', 'application/json')
+        # update() replaces the values flask_cors already set rather than
+        # appending duplicates
+        response.headers.update(_API_HEADERS)
     return response
 
 @app.route('/')
@@ -71,52 +173,77 @@ def index():
     """Render the main interface."""
     return render_template('index.html')
 
-@app.route('/api/browser/start', methods=['POST', 'OPTIONS'])
+@app.route('/api/browser/start', methods=['POST'])
 def start_browser():
     """Start the browser."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: start_browser")
         ensure_browser_started()
         logger.debug("Browser started successfully")
-        return jsonify({"success": True, "message": "Browser started successfully"})
+        return ojson({"success": True, "message": "Browser started successfully"})
     except Exception as e:
         logger.error(f"Error starting browser: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/browser/stop', methods=['POST', 'OPTIONS'])
+@app.route('/api/browser/stop', methods=['POST'])
 def stop_browser():
     """Stop the browser."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     global browser_started
     try:
         logger.debug("API call: stop_browser")
         if browser_started:
             with browser_lock:
                 if browser_started:
-                    asyncio.run(browser.stop())
+                    _run(browser.stop())
                     browser_started = False
         logger.debug("Browser stopped successfully")
-        return jsonify({"success": True, "message": "Browser stopped successfully"})
+        return ojson({"success": True, "message": "Browser stopped successfully"})
     except Exception as e:
         logger.error(f"Error stopping browser: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/session/create', methods=['POST', 'OPTIONS'])
+async def _build_session(context_id, page_id, viewport, user_agent, optimize, block_resources):
+    """Create the context and page for a session, applying optimizations if requested."""
+    # Optimized pages carry init scripts and routes, so they never go back
+    # to the context pool
+    await browser.create_context(context_id, viewport=viewport, user_agent=user_agent,
+                                 reusable=not optimize)
+    
+    optimization_options = {
+        'block_resources': block_resources,
+        'viewport': viewport
+    }
+    # Context-wide scripts go in before the page exists
+    if optimize:
+        await BrowserOptimizations.apply_context_optimizations(browser.contexts[context_id],
+                                                               optimization_options)
+    await browser.create_page(page_id, context_id)
+    
+    if optimize:
+        await BrowserOptimizations.apply_all_optimizations(browser.pages[page_id],
+                                                           optimization_options)
+    return page_id
+
+@app.route('/api/debug/console', methods=['GET'])
+def debug_console():
+    """Return and clear the console messages and page errors buffered since the last call."""
+    if not browser.debug:
+        return ojson({"success": False, "error": "Console capture is off; set BROWSER_DEBUG to enable it"}, 404)
+    
+    messages = [{"pageId": page_id, "kind": kind, "text": text}
+                for page_id, kind, text in browser.drain_console()]
+    return ojson({"success": True, "messages": messages})
+
+@app.route('/api/session/create', methods=['POST'])
 def create_session():
     """Create a new browser session."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: create_session")
         ensure_browser_started()
         
-        data = request.json or {}
+        data = _body()
+        if data is None:
+            return _invalid_body()
         context_id = get_session_id()
         page_id = get_session_id()
         
@@ -124,298 +251,248 @@ def create_session():
         viewport = data.get('viewport', None)
         user_agent = data.get('userAgent', None)
         
-        # Create context and page
-        asyncio.run(browser.create_context(context_id, viewport=viewport, user_agent=user_agent))
-        asyncio.run(browser.create_page(page_id, context_id))
+        optimize = data.get('optimize', False)
+        block_resources = data.get('blockResources', [])
         
-        # Apply optimizations if requested
-        if data.get('optimize', False):
-            page = browser.pages[page_id]
-            optimization_options = {
-                'block_resources': data.get('blockResources', []),
-                'viewport': viewport
-            }
-            asyncio.run(BrowserOptimizations.apply_all_optimizations(page, optimization_options))
+        # Create context and page (and apply optimizations) in one submission
+        _run(_build_session(context_id, page_id, viewport, user_agent,
+                            optimize, block_resources))
         
         # Store session info
-        sessions[page_id] = {
-            'context_id': context_id,
-            'created_at': time.time(),
-            'last_used': time.time()
-        }
+        sessions[page_id] = Session(page_id, context_id)
         
         logger.debug(f"Session created successfully: {page_id}")
-        return jsonify({
+        return ojson({
             "success": True, 
             "sessionId": page_id,
             "message": "Session created successfully"
         })
     except Exception as e:
         logger.error(f"Error creating session: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/session/close', methods=['POST', 'OPTIONS'])
-def close_session():
+@app.route('/api/session/close', methods=['POST'])
+@require_session
+def close_session(session, data):
     """Close a browser session."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: close_session")
-        data = request.json or {}
-        session_id = data.get('sessionId')
-        
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
+        context_id = session.context_id
         
-        context_id = sessions[session_id]['context_id']
-        
-        # Close the page and context
-        asyncio.run(browser.close_page(session_id))
-        asyncio.run(browser.close_context(context_id))
+        # Close the context, which also releases its page (or returns both
+        # to the pool)
+        _run(browser.close_context(context_id))
         
         # Remove session
-        del sessions[session_id]
+        del sessions[session.session_id]
         
-        logger.debug(f"Session closed successfully: {session_id}")
-        return jsonify({"success": True, "message": "Session closed successfully"})
+        logger.debug(f"Session closed successfully: {session.session_id}")
+        return ojson({"success": True, "message": "Session closed successfully"})
     except Exception as e:
         logger.error(f"Error closing session: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/navigate', methods=['POST', 'OPTIONS'])
-def navigate():
+@app.route('/api/navigate', methods=['POST'])
+@require_session
+def navigate(session, data):
     """Navigate to a URL."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: navigate")
-        data = request.json or {}
-        session_id = data.get('sessionId')
         url = data.get('url')
         
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
-        
         if not url:
             logger.warning("URL is required")
-            return jsonify({"success": False, "error": "URL is required"}), 400
-        
-        # Update last used time
-        sessions[session_id]['last_used'] = time.time()
+            return ojson({"success": False, "error": "URL is required"}, 400)
         
         # Navigate to URL
         wait_until = data.get('waitUntil', 'load')
         timeout = data.get('timeout', 30000)
-        result = asyncio.run(browser.navigate(session_id, url, wait_until=wait_until, timeout=timeout))
+        post_delay = data.get('postDelay', 0)
+        result = _run(browser.navigate(session.session_id, url, wait_until=wait_until,
+                                       timeout=timeout, post_delay=post_delay))
         
         logger.debug(f"Navigation result: {result}")
-        return jsonify(result)
+        return ojson(result)
     except Exception as e:
         logger.error(f"Error navigating: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/screenshot', methods=['POST', 'OPTIONS'])
-def screenshot():
-    """Take a screenshot."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
+@app.route('/api/screenshot', methods=['POST'])
+@require_session
+def screenshot(session, data):
+    """
+    Take a screenshot and return it base64-encoded in JSON.
+    
+    Deprecated: use /api/screenshot.jpg, which returns the image bytes
+    directly without the base64 overhead.
+    """
     try:
         logger.debug("API call: screenshot")
-        data = request.json or {}
-        session_id = data.get('sessionId')
-        full_page = data.get('fullPage', True)
-        
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
+        full_page = data.get('fullPage', False)
+        image_format = data.get('format', 'jpeg')
         
-        # Update last used time
-        sessions[session_id]['last_used'] = time.time()
+        if image_format not in _SCREENSHOT_FORMATS:
+            logger.warning(f"Unsupported screenshot format: {image_format}")
+            return ojson({"success": False, "error": "Unsupported screenshot format"}, 400)
         
         # Take screenshot
-        screenshot_data = asyncio.run(browser.screenshot(session_id, full_page=full_page))
+        screenshot_data = _run(browser.screenshot(session.session_id, full_page=full_page,
+                                                  image_format=image_format))
         
         logger.debug("Screenshot taken successfully")
-        return jsonify({
+        return ojson({
             "success": True,
             "screenshot": screenshot_data
         })
     except Exception as e:
         logger.error(f"Error taking screenshot: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/content', methods=['POST', 'OPTIONS'])
-def get_content():
-    """Get page content."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
+@app.route('/api/screenshot.jpg', methods=['POST'])
+@require_session
+def screenshot_jpeg(session, data):
+    """Take a screenshot and stream the raw image bytes (JPEG unless format is 'webp')."""
+    try:
+        logger.debug("API call: screenshot_jpeg")
+        full_page = data.get('fullPage', False)
+        image_format = data.get('format', 'jpeg')
         
+        if image_format not in _SCREENSHOT_FORMATS:
+            logger.warning(f"Unsupported screenshot format: {image_format}")
+            return ojson({"success": False, "error": "Unsupported screenshot format"}, 400)
+        
+        # Take screenshot
+        screenshot_bytes = _run(browser.screenshot(session.session_id, full_page=full_page,
+                                                   raw=True, image_format=image_format))
+        
+        def generate():
+            yield screenshot_bytes
+        
+        logger.debug("Screenshot taken successfully")
+        response = Response(stream_with_context(generate()), mimetype=f'image/{image_format}',
+                            direct_passthrough=True)
+        response.headers['Content-Length'] = str(len(screenshot_bytes))
+        return response
+    except Exception as e:
+        logger.error(f"Error taking screenshot: {str(e)}")
+        return ojson({"success": False, "error": str(e)}, 500)
+
+@app.route('/api/content', methods=['POST'])
+@require_session
+def get_content(session, data):
+    """Get page content."""
     try:
         logger.debug("API call: get_content")
-        data = request.json or {}
-        session_id = data.get('sessionId')
         include_html = data.get('includeHtml', False)
         
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
-        
-        # Update last used time
-        sessions[session_id]['last_used'] = time.time()
-        
         # Get content
-        content = asyncio.run(browser.get_page_content(session_id, include_html=include_html))
+        content = _run(browser.get_page_content(session.session_id, include_html=include_html))
         
         logger.debug("Content retrieved successfully")
-        return jsonify(content)
+        return ojson(content)
     except Exception as e:
         logger.error(f"Error getting content: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/execute', methods=['POST', 'OPTIONS'])
-def execute_javascript():
+@app.route('/api/execute', methods=['POST'])
+@require_session
+def execute_javascript(session, data):
     """Execute JavaScript."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: execute_javascript")
-        data = request.json or {}
-        session_id = data.get('sessionId')
         script = data.get('script')
         
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
-        
         if not script:
             logger.warning("Script is required")
-            return jsonify({"success": False, "error": "Script is required"}), 400
-        
-        # Update last used time
-        sessions[session_id]['last_used'] = time.time()
+            return ojson({"success": False, "error": "Script is required"}, 400)
         
         # Execute JavaScript
-        result = asyncio.run(browser.execute_javascript(session_id, script))
+        result = _run(browser.execute_javascript(session.session_id, script))
         
         logger.debug(f"JavaScript execution result: {result}")
-        return jsonify(result)
+        return ojson(result)
     except Exception as e:
         logger.error(f"Error executing JavaScript: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/click', methods=['POST', 'OPTIONS'])
-def click():
+@app.route('/api/click', methods=['POST'])
+@require_session
+def click(session, data):
     """Click on an element."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: click")
-        data = request.json or {}
-        session_id = data.get('sessionId')
         selector = data.get('selector')
         
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
-        
         if not selector:
             logger.warning("Selector is required")
-            return jsonify({"success": False, "error": "Selector is required"}), 400
-        
-        # Update last used time
-        sessions[session_id]['last_used'] = time.time()
+            return ojson({"success": False, "error": "Selector is required"}, 400)
         
         # Click on element
         timeout = data.get('timeout', 5000)
         button = data.get('button', 'left')
-        result = asyncio.run(browser.click(session_id, selector, timeout=timeout, button=button))
+        result = _run(browser.click(session.session_id, selector, timeout=timeout, button=button))
         
         logger.debug(f"Click result: {result}")
-        return jsonify(result)
+        return ojson(result)
     except Exception as e:
         logger.error(f"Error clicking element: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/type', methods=['POST', 'OPTIONS'])
-def type_text():
+@app.route('/api/type', methods=['POST'])
+@require_session
+def type_text(session, data):
     """Type text into an element."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: type_text")
-        data = request.json or {}
-        session_id = data.get('sessionId')
         selector = data.get('selector')
         text = data.get('text')
         
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
-        
         if not selector or not text:
             logger.warning("Selector and text are required")
-            return jsonify({"success": False, "error": "Selector and text are required"}), 400
-        
-        # Update last used time
-        sessions[session_id]['last_used'] = time.time()
+            return ojson({"success": False, "error": "Selector and text are required"}, 400)
         
         # Type text
         delay = data.get('delay', 50)
-        result = asyncio.run(browser.type_text(session_id, selector, text, delay=delay))
+        result = _run(browser.type_text(session.session_id, selector, text, delay=delay))
         
         logger.debug(f"Type text result: {result}")
-        return jsonify(result)
+        return ojson(result)
     except Exception as e:
         logger.error(f"Error typing text: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
-@app.route('/api/element', methods=['POST', 'OPTIONS'])
-def get_element_text():
+@app.route('/api/element', methods=['POST'])
+@require_session
+def get_element_text(session, data):
     """Get element text."""
-    if request.method == 'OPTIONS':
-        return jsonify({"success": True})
-        
     try:
         logger.debug("API call: get_element_text")
-        data = request.json or {}
-        session_id = data.get('sessionId')
         selector = data.get('selector')
         
-        if not session_id or session_id not in sessions:
-            logger.warning(f"Invalid session ID: {session_id}")
-            return jsonify({"success": False, "error": "Invalid session ID"}), 400
-        
         if not selector:
             logger.warning("Selector is required")
-            return jsonify({"success": False, "error": "Selector is required"}), 400
-        
-        # Update last used time
-        sessions[session_id]['last_used'] = time.time()
+            return ojson({"success": False, "error": "Selector is required"}, 400)
         
         # Get element text
-        result = asyncio.run(browser.get_element_text(session_id, selector))
+        result = _run(browser.get_element_text(session.session_id, selector))
         
         logger.debug(f"Get element text result: {result}")
-        return jsonify(result)
+        return ojson(result)
     except Exception as e:
         logger.error(f"Error getting element text: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return ojson({"success": False, "error": str(e)}, 500)
 
 def run_server(host='0.0.0.0', port=5000):
-    """Run the Flask server."""
-    app.run(host=host, port=port, debug=False)
+    """
+    Run the Flask server.
+    
+    Requests are served on separate threads; their coroutines all run on the
+    shared browser loop, so slow calls on one session don't block others.
+    The browser is launched while the server starts listening.
+    """
+    warm_browser()
+    app.run(host=host, port=port, debug=False, threaded=True)
 
 if __name__ == '__main__':
-    # Create templates directory if it doesn't exist
-    os.makedirs(os.path.join(os.path.dirname(__file__), 'templates'), exist_ok=True)
-    
     # Run the server
     run_server()
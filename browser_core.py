@@ -5,25 +5,114 @@ This module provides the core functionality for the headless browser service.
 """
 
 import asyncio
-import base64
 import json
 import os
-from typing import Dict, List, Optional, Union
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
 
-from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from playwright.async_api import Browser, BrowserContext, CDPSession, Page
+
+from browser_manager import get_browser, release_browser
+
+# SIMD base64 when available, same API as the stdlib module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Launch browser with optimized settings for headless operation
+_LAUNCH_ARGS = (
+    '--disable-gpu',
+    '--disable-dev-shm-usage',
+    '--disable-setuid-sandbox',
+    '--no-sandbox',
+    '--disable-web-security',  # Disable CORS for easier API access
+    '--disable-features=IsolateOrigins,site-per-process',
+    '--disable-site-isolation-trials',
+)
+
+_DEFAULT_VIEWPORT = {"width": 1280, "height": 800}
+
+# Options shared by every context, for better performance and compatibility
+_DEFAULT_CONTEXT_OPTS = {
+    "ignore_https_errors": True,
+    "java_script_enabled": True,
+    "bypass_csp": True,  # Bypass Content Security Policy for better compatibility
+    "viewport": _DEFAULT_VIEWPORT,
+}
+
+_PAGE_INFO_JS = "() => ({title: document.title, len: document.documentElement.outerHTML.length})"
+
+# Everything get_page_content needs, fetched in one round-trip
+_PAGE_CONTENT_JS = """inc => ({
+    title: document.title,
+    url: location.href,
+    text: document.body.innerText,
+    html: inc ? document.documentElement.outerHTML : null
+})"""
+
+# Single-round-trip fast paths for simple CSS selectors. The click helper
+# scrolls the element into view and returns the centre point to press, or
+# null unless the element is enabled, has a box, and is what a click there
+# would actually hit
+_CLICK_POINT_JS = """sel => {
+    const el = document.querySelector(sel);
+    if (!el || el.disabled) return null;
+    el.scrollIntoView({block: 'center', inline: 'center', behavior: 'instant'});
+    const r = el.getBoundingClientRect();
+    if (!r.width || !r.height) return null;
+    const x = r.left + r.width / 2, y = r.top + r.height / 2;
+    const hit = document.elementFromPoint(x, y);
+    return hit && (hit === el || el.contains(hit)) ? [x, y] : null;
+}"""
+_ELEMENT_TEXT_JS = "sel => document.querySelector(sel)?.textContent ?? null"
+
+def _add_origin(origins: Set[str], url: str) -> None:
+    """Add the origin of an http(s) URL to origins."""
+    parts = urlsplit(url)
+    if parts.scheme in ("http", "https") and parts.netloc:
+        origins.add(f"{parts.scheme}://{parts.netloc}")
+
+def _write_base64(path: str, data: str) -> None:
+    """Decode base64 image data and write it to path."""
+    with open(path, "wb") as f:
+        f.write(base64.b64decode(data))
 
 class HeadlessBrowser:
     """
     A class that provides headless browser functionality using Playwright.
     """
-    def __init__(self):
-        self.playwright = None
+    def __init__(self, max_pool: int = 4):
         self.browser = None
         self.contexts: Dict[str, BrowserContext] = {}
         self.pages: Dict[str, Page] = {}
-        self.default_viewport = {"width": 1280, "height": 800}
+        self.default_viewport = _DEFAULT_VIEWPORT
         self.browser_type = "chromium"  # Default browser type
         self.headless = True  # Default headless mode
+        
+        # Pool of idle contexts that can be handed out again instead of
+        # paying for a new BrowserContext on every session (Chromium only,
+        # since resetting one needs CDP)
+        self._free_contexts: Deque[BrowserContext] = deque()
+        self._max_pool = max_pool
+        self._pool_lock = asyncio.Lock()
+        self._reusable: Set[str] = set()
+        # Origins each reusable context has loaded, whose storage is wiped
+        # before the context is pooled
+        self._origins: Dict[str, Set[str]] = {}
+        self._listeners: Dict[str, Tuple] = {}
+        
+        # Page console output is only collected when debugging
+        self.debug = bool(os.environ.get("BROWSER_DEBUG"))
+        self._console_buf: Deque[Tuple[str, str, str]] = deque(maxlen=1000)
+        
+        # Raw CDP sessions (Chromium only) used by the hot interaction paths
+        self._cdp: Dict[str, CDPSession] = {}
+        
+        # Reverse index so closing a context doesn't scan every page
+        self._pages_by_context: Dict[str, Set[str]] = defaultdict(set)
+        self._page_contexts: Dict[str, str] = {}
 
     async def start(self, browser_type: str = "chromium", headless: bool = True) -> None:
         """
@@ -36,22 +125,8 @@ class HeadlessBrowser:
         self.browser_type = browser_type
         self.headless = headless
         
-        self.playwright = await async_playwright().start()
-        browser_instance = getattr(self.playwright, browser_type)
-        
-        # Launch browser with optimized settings for headless operation
-        self.browser = await browser_instance.launch(
-            headless=headless,
-            args=[
-                '--disable-gpu',
-                '--disable-dev-shm-usage',
-                '--disable-setuid-sandbox',
-                '--no-sandbox',
-                '--disable-web-security',  # Disable CORS for easier API access
-                '--disable-features=IsolateOrigins,site-per-process',
-                '--disable-site-isolation-trials',
-            ]
-        )
+        # Shared with any other service running in this process
+        self.browser = await get_browser(browser_type, headless, _LAUNCH_ARGS)
         
         # Create a default context and page
         await self.create_context("default")
@@ -62,28 +137,36 @@ class HeadlessBrowser:
     async def stop(self) -> None:
         """Stop the browser service and clean up resources."""
         if self.browser:
+            # Nothing goes back to the pool while shutting down
+            self._reusable.clear()
             for context_id in list(self.contexts.keys()):
                 await self.close_context(context_id)
             
-            await self.browser.close()
+            while self._free_contexts:
+                await self._free_contexts.popleft().close()
+            
+            # Other services may still be using the shared browser
+            await release_browser(self.browser)
             self.browser = None
         
-        if self.playwright:
-            await self.playwright.stop()
-            self.playwright = None
-        
         print("Browser stopped")
 
     async def create_context(self, context_id: str, 
                            viewport: Optional[Dict[str, int]] = None,
-                           user_agent: Optional[str] = None) -> None:
+                           user_agent: Optional[str] = None,
+                           reusable: bool = True) -> None:
         """
         Create a new browser context with the given ID.
         
+        Contexts with the default viewport and user agent are checked out of
+        the idle pool when one is available.
+        
         Args:
             context_id: Unique identifier for the context
             viewport: Viewport dimensions (width and height)
             user_agent: Custom user agent string
+            reusable: Whether the context may be returned to the pool when
+                closed (pass False if pages get init scripts or routes)
         """
         if not self.browser:
             raise RuntimeError("Browser not started")
@@ -91,24 +174,28 @@ class HeadlessBrowser:
         if context_id in self.contexts:
             await self.close_context(context_id)
         
-        context_options = {}
+        poolable = (reusable and self.browser_type == "chromium" and user_agent is None
+                    and viewport in (None, self.default_viewport))
         
+        if poolable:
+            async with self._pool_lock:
+                if self._free_contexts:
+                    self.contexts[context_id] = self._free_contexts.popleft()
+                    self._reusable.add(context_id)
+                    self._origins[context_id] = set()
+                    print(f"Reused pooled context: {context_id}")
+                    return
+        
+        context_options = {**_DEFAULT_CONTEXT_OPTS}
         if viewport:
             context_options["viewport"] = viewport
-        else:
-            context_options["viewport"] = self.default_viewport
-            
         if user_agent:
             context_options["user_agent"] = user_agent
         
-        # Add additional options for better performance and compatibility
-        context_options.update({
-            "ignore_https_errors": True,
-            "java_script_enabled": True,
-            "bypass_csp": True,  # Bypass Content Security Policy for better compatibility
-        })
-        
         self.contexts[context_id] = await self.browser.new_context(**context_options)
+        if poolable:
+            self._reusable.add(context_id)
+            self._origins[context_id] = set()
         print(f"Created context: {context_id}")
 
     async def close_context(self, context_id: str) -> None:
@@ -119,19 +206,84 @@ class HeadlessBrowser:
             context_id: ID of the context to close
         """
         if context_id in self.contexts:
+            context = self.contexts.pop(context_id)
+            
             # Close all pages in this context
-            page_ids = [pid for pid, page in self.pages.items() 
-                      if page.context == self.contexts[context_id]]
+            pages = []
+            cdp_sessions = []
+            for page_id in self._pages_by_context.pop(context_id, ()):
+                self._page_contexts.pop(page_id, None)
+                page = self.pages.pop(page_id)
+                self._detach_listeners(page_id, page)
+                pages.append(page)
+                if page_id in self._cdp:
+                    cdp_sessions.append(self._cdp.pop(page_id))
+            
+            origins = self._origins.pop(context_id, set())
             
-            for page_id in page_ids:
-                if page_id in self.pages:
-                    del self.pages[page_id]
+            if context_id in self._reusable:
+                self._reusable.discard(context_id)
+                for cdp in cdp_sessions:
+                    try:
+                        await cdp.detach()
+                    except Exception:
+                        pass
+                if await self._recycle_context(context, pages, origins):
+                    print(f"Returned context to pool: {context_id}")
+                    return
             
             # Close the context
-            await self.contexts[context_id].close()
-            del self.contexts[context_id]
+            await context.close()
             print(f"Closed context: {context_id}")
 
+    async def _recycle_context(self, context: BrowserContext, pages: List[Page],
+                               origins: Set[str]) -> bool:
+        """
+        Reset a context and push it onto the idle pool.
+        
+        Everything the previous session left behind is cleared: cookies,
+        permissions, and the storage (local/session storage, IndexedDB, cache,
+        service workers) of every origin it loaded. Its pages are closed so
+        no tab-scoped state survives either.
+        
+        Args:
+            context: Context to recycle
+            pages: Pages that belonged to the context
+            origins: Origins loaded in the context's pages
+            
+        Returns:
+            True if the context was pooled, False if it should be closed
+        """
+        if len(self._free_contexts) >= self._max_pool:
+            return False
+        
+        # The reset runs outside the pool lock so it doesn't hold up other
+        # sessions being created or closed
+        try:
+            live_pages = [page for page in pages if not page.is_closed()]
+            if origins:
+                page = live_pages[0] if live_pages else await context.new_page()
+                live_pages = [page] + live_pages[1:]
+                cdp = await context.new_cdp_session(page)
+                for origin in origins:
+                    await cdp.send("Storage.clearDataForOrigin",
+                                   {"origin": origin, "storageTypes": "all"})
+                await cdp.detach()
+            
+            for page in live_pages:
+                await page.close()
+            await context.clear_cookies()
+            await context.clear_permissions()
+        except Exception as e:
+            print(f"Could not recycle context: {e}")
+            return False
+        
+        async with self._pool_lock:
+            if len(self._free_contexts) >= self._max_pool:
+                return False
+            self._free_contexts.append(context)
+            return True
+
     async def create_page(self, page_id: str, context_id: str) -> None:
         """
         Create a new page with the given ID in the specified context.
@@ -146,14 +298,67 @@ class HeadlessBrowser:
         if page_id in self.pages:
             await self.close_page(page_id)
         
-        self.pages[page_id] = await self.contexts[context_id].new_page()
+        page = await self.contexts[context_id].new_page()
+        self.pages[page_id] = page
+        self._pages_by_context[context_id].add(page_id)
+        self._page_contexts[page_id] = context_id
         
         # Set up page event handlers for better monitoring
-        self.pages[page_id].on("console", lambda msg: print(f"Console {page_id}: {msg.text}"))
-        self.pages[page_id].on("pageerror", lambda err: print(f"Error {page_id}: {err}"))
+        self._attach_listeners(page_id, page)
+        
+        # Remember where pages of a poolable context go, so their storage can
+        # be cleared before the context is reused; child frames count too
+        origins = self._origins.get(context_id)
+        if origins is not None:
+            page.on("framenavigated", lambda frame: _add_origin(origins, frame.url))
+        
+        if self.browser_type == "chromium":
+            self._cdp[page_id] = await self.contexts[context_id].new_cdp_session(page)
         
         print(f"Created page: {page_id} in context: {context_id}")
 
+    def _attach_listeners(self, page_id: str, page: Page) -> None:
+        """
+        Register the console/error handlers for a page.
+        
+        Only done when BROWSER_DEBUG is set, so chatty pages don't stall the
+        event loop. Messages are buffered rather than printed; read them with
+        drain_console().
+        """
+        if not self.debug:
+            return
+        
+        buf = self._console_buf
+        on_console = lambda msg: buf.append((page_id, "console", msg.text))
+        on_error = lambda err: buf.append((page_id, "pageerror", str(err)))
+        page.on("console", on_console)
+        page.on("pageerror", on_error)
+        self._listeners[page_id] = (on_console, on_error)
+
+    def drain_console(self) -> List[Tuple[str, str, str]]:
+        """
+        Return and clear the buffered console messages.
+        
+        Returns:
+            List of (page_id, kind, text) tuples, where kind is 'console' or
+            'pageerror'
+        """
+        # popleft is atomic, so messages appended meanwhile are never lost
+        buf = self._console_buf
+        messages = []
+        while True:
+            try:
+                messages.append(buf.popleft())
+            except IndexError:
+                return messages
+
+    def _detach_listeners(self, page_id: str, page: Page) -> None:
+        """Remove the handlers registered by _attach_listeners."""
+        listeners = self._listeners.pop(page_id, None)
+        if listeners:
+            page.remove_listener("console", listeners[0])
+            page.remove_listener("pageerror", listeners[1])
+
     async def close_page(self, page_id: str) -> None:
         """
         Close a page.
@@ -162,13 +367,63 @@ class HeadlessBrowser:
             page_id: ID of the page to close
         """
         if page_id in self.pages:
-            await self.pages[page_id].close()
-            del self.pages[page_id]
+            page = self.pages.pop(page_id)
+            self._detach_listeners(page_id, page)
+            self._cdp.pop(page_id, None)
+            context_id = self._page_contexts.pop(page_id, None)
+            if context_id is not None:
+                self._pages_by_context[context_id].discard(page_id)
+            await page.close()
             print(f"Closed page: {page_id}")
 
+    async def _cdp_evaluate(self, page_id: str, expression: str):
+        """
+        Evaluate an expression through the page's cached CDP session.
+        
+        Args:
+            page_id: ID of the page to evaluate in
+            expression: JavaScript expression to evaluate
+            
+        Returns:
+            The value of the expression
+            
+        Raises:
+            RuntimeError: If there is no CDP session or the expression throws
+        """
+        cdp = self._cdp.get(page_id)
+        if cdp is None:
+            raise RuntimeError(f"No CDP session for page {page_id}")
+        
+        result = await cdp.send("Runtime.evaluate", {
+            "expression": expression,
+            "returnByValue": True
+        })
+        if "exceptionDetails" in result:
+            raise RuntimeError(result["exceptionDetails"].get("text", "Evaluation failed"))
+        return result["result"].get("value")
+
+    async def _evaluate_function(self, page_id: str, function: str, arg):
+        """
+        Call a JavaScript function with one argument in a single round-trip.
+        
+        Uses the cached CDP session on Chromium and page.evaluate elsewhere.
+        
+        Args:
+            page_id: ID of the page to evaluate in
+            function: JavaScript function taking a single argument
+            arg: JSON-serializable argument to pass to the function
+            
+        Returns:
+            The return value of the function
+        """
+        if page_id in self._cdp:
+            return await self._cdp_evaluate(page_id, f"({function})({json.dumps(arg)})")
+        return await self.pages[page_id].evaluate(function, arg)
+
     async def navigate(self, page_id: str, url: str, 
                      wait_until: str = "load", 
-                     timeout: int = 30000) -> Dict:
+                     timeout: int = 30000,
+                     post_delay: int = 0) -> Dict:
         """
         Navigate to a URL in the specified page.
         
@@ -177,6 +432,7 @@ class HeadlessBrowser:
             url: URL to navigate to
             wait_until: Navigation wait condition ('load', 'domcontentloaded', 'networkidle')
             timeout: Navigation timeout in milliseconds
+            post_delay: Extra time to wait after navigation, in milliseconds
             
         Returns:
             Dict containing page information after navigation
@@ -190,18 +446,19 @@ class HeadlessBrowser:
             response = await page.goto(url, wait_until=wait_until, timeout=timeout)
             status = response.status if response else None
             
-            # Wait a bit for JavaScript to execute
-            await page.wait_for_timeout(500)
+            # Optionally wait for JavaScript to execute
+            if post_delay:
+                await page.wait_for_timeout(post_delay)
             
-            title = await page.title()
-            content = await page.content()
+            # Fetch title and content length in a single round-trip
+            info = await page.evaluate(_PAGE_INFO_JS)
             
             return {
                 "success": True,
                 "url": page.url,
-                "title": title,
+                "title": info["title"],
                 "status": status,
-                "content_length": len(content)
+                "content_length": info["len"]
             }
         except Exception as e:
             return {
@@ -212,7 +469,9 @@ class HeadlessBrowser:
 
     async def screenshot(self, page_id: str, 
                        full_page: bool = True,
-                       path: Optional[str] = None) -> Optional[str]:
+                       path: Optional[str] = None,
+                       raw: bool = False,
+                       image_format: str = "jpeg") -> Optional[Union[str, bytes]]:
         """
         Take a screenshot of the specified page.
         
@@ -220,13 +479,30 @@ class HeadlessBrowser:
             page_id: ID of the page to screenshot
             full_page: Whether to capture the full page or just the viewport
             path: Path to save the screenshot to (optional)
+            raw: Return the image bytes instead of base64-encoded data
+            image_format: 'jpeg', or 'webp' for a smaller image (Chromium only)
             
         Returns:
-            Base64-encoded screenshot data if path is None, otherwise None
+            Base64-encoded screenshot data (or raw bytes if raw is True) if
+            path is None, otherwise None
         """
         if page_id not in self.pages:
             raise ValueError(f"Page {page_id} does not exist")
         
+        # Encoding multi-MB images runs on the default executor so the loop
+        # keeps serving other pages' CDP traffic meanwhile
+        loop = asyncio.get_running_loop()
+        
+        if image_format == "webp":
+            data = await self._capture_webp(page_id, full_page)
+            if path:
+                await loop.run_in_executor(None, _write_base64, path, data)
+                return None
+            return await loop.run_in_executor(None, base64.b64decode, data) if raw else data
+        
+        if image_format != "jpeg":
+            raise ValueError(f"Unsupported screenshot format: {image_format}")
+        
         page = self.pages[page_id]
         
         screenshot_options = {
@@ -241,7 +517,36 @@ class HeadlessBrowser:
             return None
         else:
             screenshot_bytes = await page.screenshot(**screenshot_options)
-            return base64.b64encode(screenshot_bytes).decode('utf-8')
+            if raw:
+                return screenshot_bytes
+            encoded = await loop.run_in_executor(None, base64.b64encode, screenshot_bytes)
+            return encoded.decode('ascii')
+
+    async def _capture_webp(self, page_id: str, full_page: bool) -> str:
+        """
+        Capture a WebP screenshot through the page's CDP session.
+        
+        Args:
+            page_id: ID of the page to screenshot
+            full_page: Whether to capture the full page or just the viewport
+            
+        Returns:
+            Base64-encoded WebP data, as returned by Chromium
+        """
+        cdp = self._cdp.get(page_id)
+        if cdp is None:
+            raise ValueError("WebP screenshots are only supported on Chromium")
+        
+        params = {"format": "webp", "quality": 80}
+        if full_page:
+            metrics = await cdp.send("Page.getLayoutMetrics")
+            size = metrics.get("cssContentSize") or metrics["contentSize"]
+            params["clip"] = {"x": 0, "y": 0, "width": size["width"],
+                              "height": size["height"], "scale": 1}
+            params["captureBeyondViewport"] = True
+        
+        result = await cdp.send("Page.captureScreenshot", params)
+        return result["data"]
 
     async def execute_javascript(self, page_id: str, script: str) -> Dict:
         """
@@ -291,6 +596,33 @@ class HeadlessBrowser:
         
         page = self.pages[page_id]
         
+        # On Chromium an element that is clickable right now gets real mouse
+        # input over CDP; anything else falls back to Playwright's click,
+        # which waits for actionability up to the timeout
+        cdp = self._cdp.get(page_id)
+        if cdp is not None:
+            try:
+                point = await self._cdp_evaluate(
+                    page_id, f"({_CLICK_POINT_JS})({json.dumps(selector)})")
+            except Exception:
+                point = None
+            if point is not None:
+                x, y = point
+                try:
+                    await cdp.send("Input.dispatchMouseEvent",
+                                   {"type": "mouseMoved", "x": x, "y": y})
+                    for event_type in ("mousePressed", "mouseReleased"):
+                        await cdp.send("Input.dispatchMouseEvent", {
+                            "type": event_type, "x": x, "y": y,
+                            "button": button, "clickCount": 1
+                        })
+                    return {"success": True}
+                except Exception as e:
+                    return {
+                        "success": False,
+                        "error": str(e)
+                    }
+        
         try:
             await page.click(selector, timeout=timeout, button=button)
             return {"success": True}
@@ -343,27 +675,18 @@ class HeadlessBrowser:
         if page_id not in self.pages:
             raise ValueError(f"Page {page_id} does not exist")
         
-        page = self.pages[page_id]
-        
         try:
-            title = await page.title()
-            url = page.url
-            
-            # Extract text content
-            text_content = await page.evaluate("""() => {
-                return document.body.innerText;
-            }""")
+            info = await self._evaluate_function(page_id, _PAGE_CONTENT_JS, include_html)
             
             result = {
                 "success": True,
-                "url": url,
-                "title": title,
-                "text_content": text_content
+                "url": info["url"],
+                "title": info["title"],
+                "text_content": info["text"]
             }
             
             if include_html:
-                html_content = await page.content()
-                result["html_content"] = html_content
+                result["html_content"] = info["html"]
                 
             return result
         except Exception as e:
@@ -388,6 +711,16 @@ class HeadlessBrowser:
         
         page = self.pages[page_id]
         
+        try:
+            text = await self._evaluate_function(page_id, _ELEMENT_TEXT_JS, selector)
+            if text is not None:
+                return {
+                    "success": True,
+                    "text": text
+                }
+        except Exception:
+            pass
+        
         try:
             text = await page.text_content(selector)
             return {
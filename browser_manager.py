@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Shared Browser Manager
+This module owns the Playwright browsers used by the server modules, so
+services running in one process share a browser instead of each launching
+their own.
+"""
+
+import asyncio
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+from playwright.async_api import async_playwright, Browser, Playwright
+
+_playwright: Optional[Playwright] = None
+_browsers: Dict[Tuple, Browser] = {}  # Launch settings -> shared browser
+_refs: Dict[Tuple, int] = {}  # Launch settings -> number of holders
+_lock: Optional[asyncio.Lock] = None  # Created on first use so it is bound to the caller's loop
+
+
+def _key(browser_type: str, headless: bool, args: Sequence[str]) -> Tuple:
+    """Identify the browser a caller needs; callers with equal keys share it."""
+    endpoint = os.environ.get("PLAYWRIGHT_WS_ENDPOINT")
+    if endpoint and browser_type == "chromium":
+        return ("cdp", endpoint)
+    return (browser_type, headless, tuple(args))
+
+
+async def get_browser(browser_type: str = "chromium", headless: bool = True,
+                      args: Sequence[str] = ()) -> Browser:
+    """
+    Acquire a shared browser, starting it if nobody holds one yet.
+
+    Callers asking for the same browser type, headless mode and arguments
+    share one browser; different settings get their own. Pair every call
+    with release_browser(). If PLAYWRIGHT_WS_ENDPOINT is set, Chromium
+    requests attach to that already running browser through
+    connect_over_cdp instead of launching one. Browsers belong to the event
+    loop of the first call, so every caller must run on that loop.
+
+    Args:
+        browser_type: Type of browser to launch ('chromium', 'firefox', or 'webkit')
+        headless: Whether to run in headless mode
+        args: Extra command line arguments for the launched browser
+
+    Returns:
+        The shared Browser instance
+    """
+    global _playwright, _lock
+    if _lock is None:
+        _lock = asyncio.Lock()
+
+    key = _key(browser_type, headless, args)
+    async with _lock:
+        browser = _browsers.get(key)
+        if browser is None or not browser.is_connected():
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+
+            if key[0] == "cdp":
+                browser = await _playwright.chromium.connect_over_cdp(key[1])
+            else:
+                browser = await getattr(_playwright, browser_type).launch(
+                    headless=headless, args=list(args))
+            _browsers[key] = browser
+            # Holders of a disconnected browser release it by identity and
+            # find nothing, so the count starts over with the replacement
+            _refs[key] = 0
+        _refs[key] += 1
+    return browser
+
+
+async def release_browser(browser: Browser) -> None:
+    """
+    Give back a browser from get_browser().
+
+    The browser is closed (or disconnected from) once its last holder
+    releases it, and Playwright stops when no browsers are left.
+
+    Args:
+        browser: Browser returned by get_browser()
+    """
+    global _playwright
+    if _lock is None:
+        return
+
+    async with _lock:
+        key = next((k for k, b in _browsers.items() if b is browser), None)
+        if key is None:
+            return
+
+        _refs[key] -= 1
+        if _refs[key] > 0:
+            return
+
+        del _refs[key], _browsers[key]
+        await browser.close()
+        if not _browsers and _playwright:
+            await _playwright.stop()
+            _playwright = None
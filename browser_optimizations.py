@@ -10,83 +10,132 @@ import os
 import time
 from typing import Dict, List, Optional, Union
 
+# Bit per Playwright resource type, so the route handler tests an int mask
+_RT_BITS = {
+    'document': 1 << 0,
+    'stylesheet': 1 << 1,
+    'image': 1 << 2,
+    'media': 1 << 3,
+    'font': 1 << 4,
+    'script': 1 << 5,
+    'texttrack': 1 << 6,
+    'xhr': 1 << 7,
+    'fetch': 1 << 8,
+    'eventsource': 1 << 9,
+    'websocket': 1 << 10,
+    'manifest': 1 << 11,
+    'other': 1 << 12,
+}
+
 class BrowserOptimizations:
     """
     A class that provides optimizations for the headless browser.
     """
     
     @staticmethod
-    async def optimize_page_for_complex_sites(page):
+    def optimize_page_for_complex_sites():
         """
-        Apply optimizations to a page for handling complex websites.
+        Build the init script for handling complex websites.
         
-        Args:
-            page: Playwright page object
+        Returns:
+            JavaScript source that disables animations and removes overlays
         """
-        # Set default timeout to a higher value for complex sites
-        page.set_default_timeout(60000)
-        
-        # Inject performance optimization script
-        await page.add_init_script("""
-            // Disable animations for better performance
+        # Disable animations and dismiss overlays
+        return """
+            // Disable animations for better performance with a constructed
+            // stylesheet, which needs neither a <style> node nor document.head
             if (typeof document !== 'undefined') {
-                const style = document.createElement('style');
-                style.type = 'text/css';
-                style.innerHTML = `
-                    * {
-                        animation-duration: 0.001s !important;
-                        transition-duration: 0.001s !important;
+                const css = '*{animation-duration:.001s !important;transition-duration:.001s !important;}';
+                if ('adoptedStyleSheets' in document) {
+                    const sheet = new CSSStyleSheet();
+                    sheet.replaceSync(css);
+                    document.adoptedStyleSheets = [...document.adoptedStyleSheets, sheet];
+                } else {
+                    // Older engines: fall back to a <style> element once the
+                    // head has been parsed
+                    const addStyle = () => {
+                        const style = document.createElement('style');
+                        style.textContent = css;
+                        document.head.appendChild(style);
+                    };
+                    if (document.head) {
+                        addStyle();
+                    } else {
+                        document.addEventListener('DOMContentLoaded', addStyle, {once: true});
                     }
-                `;
-                document.head.appendChild(style);
+                }
             }
-        """)
-        
-        # Add script to handle common overlay/popup scenarios
-        await page.add_init_script("""
+            
+            // Common selectors for overlays, cookie notices, etc., built once
+            // as a single :is() list so the engine can reuse the parsed selector
+            const OVERLAY_SEL =
+                ':is([class*="cookie"],[class*="popup"],[class*="modal"],[class*="overlay"])';
+            
+            // Well-known overlay ids, looked up directly instead of scanning
+            // every element's id for a substring
+            const KNOWN_OVERLAY_IDS = [
+                'cookie-banner', 'cookieConsent', 'cookie-consent', 'cookie-notice',
+                'cookie-law-info-bar', 'CybotCookiebotDialog', 'onetrust-banner-sdk',
+                'onetrust-consent-sdk', 'gdpr', 'gdpr-popup', 'gdpr-consent',
+                'consent-banner'
+            ];
+            
             // Auto-dismiss common overlays and popups
             if (typeof window !== 'undefined') {
                 window.addEventListener('load', () => {
                     // Function to remove common overlay elements
+                    // Only elements positioned out of flow count as overlays, so
+                    // a normal element with a matching id or class is kept; the
+                    // inline style avoids a computed-style lookup
+                    const isOverlay = el => {
+                        const pos = el.style.position || window.getComputedStyle(el).position;
+                        return pos === 'fixed' || pos === 'absolute';
+                    };
+                    
                     const removeOverlays = () => {
-                        // Common selectors for overlays, cookie notices, etc.
-                        const overlaySelectors = [
-                            '[class*="cookie"]',
-                            '[class*="popup"]',
-                            '[class*="modal"]',
-                            '[class*="overlay"]',
-                            '[id*="cookie"]',
-                            '[id*="popup"]',
-                            '[id*="modal"]',
-                            '[id*="overlay"]'
-                        ];
+                        const toRemove = [];
                         
-                        overlaySelectors.forEach(selector => {
-                            document.querySelectorAll(selector).forEach(el => {
-                                // Only remove if it appears to be an overlay
-                                if (el.style.position === 'fixed' || 
-                                    el.style.position === 'absolute' ||
-                                    window.getComputedStyle(el).position === 'fixed' ||
-                                    window.getComputedStyle(el).position === 'absolute') {
-                                    el.remove();
-                                }
-                            });
+                        // Read every position before touching the DOM so the
+                        // style lookups are not interleaved with invalidations
+                        for (const id of KNOWN_OVERLAY_IDS) {
+                            const el = document.getElementById(id);
+                            if (el && isOverlay(el)) toRemove.push(el);
+                        }
+                        document.querySelectorAll(OVERLAY_SEL).forEach(el => {
+                            if (isOverlay(el)) toRemove.push(el);
                         });
                         
+                        // Hide them all in one style pass, then detach the
+                        // already out-of-flow nodes after a microtask
+                        toRemove.forEach(el => { el.style.display = 'none'; });
+                        if (toRemove.length) {
+                            queueMicrotask(() => toRemove.forEach(el => el.remove()));
+                        }
+                        
                         // Remove fixed/hidden body styles that prevent scrolling
                         if (document.body.style.overflow === 'hidden') {
                             document.body.style.overflow = 'auto';
                         }
                     };
                     
-                    // Run initially and then periodically
+                    // Run initially and then whenever nodes are added,
+                    // coalescing bursts of mutations into one idle pass.
+                    // Removals (including our own) leave nothing to scan.
                     removeOverlays();
-                    setInterval(removeOverlays, 2000);
+                    const idle = window.requestIdleCallback || (cb => setTimeout(cb, 50));
+                    let scheduled = false;
+                    const mo = new MutationObserver(records => {
+                        if (scheduled || !records.some(r => r.addedNodes.length)) return;
+                        scheduled = true;
+                        idle(() => {
+                            scheduled = false;
+                            removeOverlays();
+                        });
+                    });
+                    mo.observe(document.documentElement, {childList: true, subtree: true});
                 });
             }
-        """)
-        
-        return page
+        """
     
     @staticmethod
     async def setup_request_interception(page, block_resources=None):
@@ -95,28 +144,35 @@ class BrowserOptimizations:
         
         Args:
             page: Playwright page object
-            block_resources: List of resource types to block (e.g., ['image', 'font', 'media'])
+            block_resources: List of resource types to block (e.g., ['image', 'font', 'media']).
+                When omitted or empty no route is registered and network
+                traffic is left untouched.
         """
-        if block_resources is None:
-            block_resources = []
-            
+        mask = 0
+        for resource_type in block_resources or ():
+            mask |= _RT_BITS.get(resource_type, 0)
+
+        # Without anything to block a route would only add a round-trip per request
+        if not mask:
+            return page
+
         # Set up route handler to block specified resource types
-        await page.route('**/*', lambda route, request: 
-            route.abort() if request.resource_type in block_resources else route.continue_()
+        await page.route('**/*', lambda route, request:
+            route.abort() if _RT_BITS.get(request.resource_type, 0) & mask else route.continue_()
         )
         
         return page
     
     @staticmethod
-    async def inject_performance_monitoring(page):
+    def inject_performance_monitoring():
         """
-        Inject performance monitoring script into the page.
+        Build the performance monitoring init script.
         
-        Args:
-            page: Playwright page object
+        Returns:
+            JavaScript source that records load timings on window.__performanceMetrics
         """
         # Add performance monitoring
-        await page.add_init_script("""
+        return """
             // Performance monitoring
             if (typeof window !== 'undefined' && window.performance) {
                 window.addEventListener('load', () => {
@@ -125,10 +181,6 @@ class BrowserOptimizations:
                         const pageLoadTime = perfData.loadEventEnd - perfData.navigationStart;
                         const domReadyTime = perfData.domComplete - perfData.domLoading;
                         
-                        console.log('Performance metrics:');
-                        console.log(`Page load time: ${pageLoadTime}ms`);
-                        console.log(`DOM ready time: ${domReadyTime}ms`);
-                        
                         // Store metrics for later retrieval
                         window.__performanceMetrics = {
                             pageLoadTime,
@@ -138,20 +190,38 @@ class BrowserOptimizations:
                     }, 0);
                 });
             }
-        """)
-        
-        return page
+        """
     
     @staticmethod
-    async def optimize_for_javascript_heavy_sites(page):
+    async def read_metrics(page):
         """
-        Apply optimizations for JavaScript-heavy sites.
+        Read the metrics recorded by the performance monitoring script.
         
         Args:
             page: Playwright page object
+        
+        Returns:
+            Dict with pageLoadTime, domReadyTime and timestamp, or None if the
+            page has not finished loading
+        """
+        return await page.evaluate("() => window.__performanceMetrics ?? null")
+    
+    @staticmethod
+    def optimize_for_javascript_heavy_sites(chromium=True, expose_gc=False):
+        """
+        Build the init script for JavaScript-heavy sites.
+        
+        Args:
+            chromium: Include the leak detector, which relies on the
+                Chromium-only performance.memory
+            expose_gc: Include the GC hint; only useful when Chromium was
+                launched with --js-flags=--expose-gc
+        
+        Returns:
+            JavaScript source for GC hints, rejection handling and leak detection
         """
         # Increase JavaScript heap size
-        await page.context.add_init_script("""
+        gc_hint = """
             // Attempt to increase memory limits where possible
             if (typeof window !== 'undefined' && window.performance) {
                 try {
@@ -163,10 +233,10 @@ class BrowserOptimizations:
                     console.log('GC not available');
                 }
             }
-        """)
+        """
         
         # Add error handling for unhandled promise rejections
-        await page.add_init_script("""
+        rejections = """
             // Catch unhandled promise rejections
             if (typeof window !== 'undefined') {
                 window.addEventListener('unhandledrejection', event => {
@@ -175,44 +245,77 @@ class BrowserOptimizations:
                     event.preventDefault();
                 });
             }
-        """)
+        """
         
         # Monitor for memory leaks
-        await page.add_init_script("""
+        memory_monitor = """
             // Basic memory leak detection
             if (typeof window !== 'undefined' && window.performance && window.performance.memory) {
-                const memoryUsage = [];
+                // Ring buffer of the last 10 heap sizes
+                const SAMPLES = 10;
+                const heapSizes = new Array(SAMPLES);
+                let count = 0;
+                let next = 0;
+                let delay = 5000;
+                let timer = null;
+                
+                const leaking = () => {
+                    // Check for continuous growth over the buffered samples
+                    const first = (next - count + SAMPLES) % SAMPLES;
+                    for (let i = 1; i < count; i++) {
+                        if (heapSizes[(first + i) % SAMPLES] < heapSizes[(first + i - 1) % SAMPLES]) {
+                            return false;
+                        }
+                    }
+                    return true;
+                };
+                
                 const checkMemory = () => {
-                    const memory = window.performance.memory;
-                    memoryUsage.push({
-                        usedJSHeapSize: memory.usedJSHeapSize,
-                        totalJSHeapSize: memory.totalJSHeapSize,
-                        timestamp: Date.now()
-                    });
+                    timer = null;
+                    heapSizes[next] = window.performance.memory.usedJSHeapSize;
+                    next = (next + 1) % SAMPLES;
+                    if (count < SAMPLES) count++;
                     
-                    // Keep only last 10 measurements
-                    if (memoryUsage.length > 10) {
-                        memoryUsage.shift();
+                    if (count >= 5 && leaking()) {
+                        // One warning is enough; stop sampling once flagged
+                        console.warn('Potential memory leak detected: continuously increasing heap size');
+                        document.removeEventListener('visibilitychange', onVisibility);
+                        return;
                     }
                     
-                    // Check for continuous growth (potential memory leak)
-                    if (memoryUsage.length >= 5) {
-                        const allIncreasing = memoryUsage.every((m, i, arr) => 
-                            i === 0 || m.usedJSHeapSize >= arr[i-1].usedJSHeapSize
-                        );
-                        
-                        if (allIncreasing) {
-                            console.warn('Potential memory leak detected: continuously increasing heap size');
-                        }
+                    // Back off exponentially up to one sample a minute
+                    delay = Math.min(delay * 2, 60000);
+                    schedule();
+                };
+                
+                const schedule = () => {
+                    if (timer === null && document.visibilityState !== 'hidden') {
+                        timer = setTimeout(checkMemory, delay);
+                    }
+                };
+                
+                // Pause sampling while the page is hidden
+                const onVisibility = () => {
+                    if (document.visibilityState === 'hidden') {
+                        clearTimeout(timer);
+                        timer = null;
+                    } else {
+                        schedule();
                     }
                 };
                 
-                // Check memory usage periodically
-                setInterval(checkMemory, 5000);
+                document.addEventListener('visibilitychange', onVisibility);
+                schedule();
             }
-        """)
+        """
         
-        return page
+        # Skip scripts that could never do anything in this browser
+        scripts = [rejections]
+        if expose_gc:
+            scripts.insert(0, gc_hint)
+        if chromium:
+            scripts.append(memory_monitor)
+        return "".join(scripts)
     
     @staticmethod
     async def setup_viewport_optimization(page, viewport=None):
@@ -226,23 +329,95 @@ class BrowserOptimizations:
         if viewport:
             await page.set_viewport_size(viewport)
         
+        return page
+    
+    @staticmethod
+    def optimize_viewport():
+        """
+        Build the high DPI viewport init script.
+        
+        Returns:
+            JavaScript source that adds a viewport meta tag
+        """
         # Add high DPI support
-        await page.add_init_script("""
-            // Optimize for high DPI displays
-            if (typeof document !== 'undefined') {
+        return """
+            // Optimize for high DPI displays, unless the page ships its own tag.
+            // Init scripts run before the document is parsed, so wait for the
+            // page's head (and any meta tag in it) to exist first
+            const addViewportMeta = () => {
+                if (document.querySelector('meta[name="viewport"]')) return;
                 const meta = document.createElement('meta');
-                meta.setAttribute('name', 'viewport');
-                meta.setAttribute('content', 'width=device-width, initial-scale=1, maximum-scale=1');
-                document.head.appendChild(meta);
+                meta.name = 'viewport';
+                meta.content = 'width=device-width, initial-scale=1, maximum-scale=1';
+                (document.head || document.documentElement).appendChild(meta);
+            };
+            if (typeof document !== 'undefined') {
+                if (document.readyState === 'loading') {
+                    document.addEventListener('DOMContentLoaded', addViewportMeta, {once: true});
+                } else {
+                    addViewportMeta();
+                }
             }
-        """)
+        """
+    
+    @staticmethod
+    def build_init_script(options=None, browser_name=None):
+        """
+        Combine every optimization script into a single init script.
         
-        return page
+        Each script runs in its own IIFE so their declarations cannot clash, and
+        inside a try/catch so one that throws doesn't stop the ones after it.
+        
+        Args:
+            options: Dictionary of optimization options
+                - expose_gc: Browser was launched with --js-flags=--expose-gc
+            browser_name: Browser type name (e.g. 'chromium'); None if unknown
+        
+        Returns:
+            JavaScript source to pass to one add_init_script call
+        """
+        if options is None:
+            options = {}
+        
+        scripts = (
+            BrowserOptimizations.optimize_page_for_complex_sites(),
+            BrowserOptimizations.inject_performance_monitoring(),
+            BrowserOptimizations.optimize_for_javascript_heavy_sites(
+                chromium=browser_name in (None, 'chromium'),
+                expose_gc=options.get('expose_gc', False)
+            ),
+            BrowserOptimizations.optimize_viewport(),
+        )
+        return "\n".join(f"(() => {{ try {{{js}}} catch (e) {{}} }})();" for js in scripts)
+    
+    @staticmethod
+    async def apply_context_optimizations(context, options=None):
+        """
+        Register the optimization scripts once for every page of a context.
+        
+        Args:
+            context: Playwright browser context object
+            options: Dictionary of optimization options
+        """
+        if options is None:
+            options = {}
+        
+        browser = context.browser
+        browser_name = browser.browser_type.name if browser else None
+        
+        # Every script goes in with a single CDP round-trip
+        await context.add_init_script(
+            BrowserOptimizations.build_init_script(options, browser_name)
+        )
+        
+        return context
     
     @staticmethod
     async def apply_all_optimizations(page, options=None):
         """
-        Apply all optimizations to a page.
+        Apply the per-page optimizations to a page.
+        
+        Scripts are registered on the context by apply_context_optimizations.
         
         Args:
             page: Playwright page object
@@ -253,15 +428,17 @@ class BrowserOptimizations:
         if options is None:
             options = {}
             
-        # Apply all optimizations
-        await BrowserOptimizations.optimize_page_for_complex_sites(page)
-        await BrowserOptimizations.setup_request_interception(
-            page, options.get('block_resources', [])
-        )
-        await BrowserOptimizations.inject_performance_monitoring(page)
-        await BrowserOptimizations.optimize_for_javascript_heavy_sites(page)
-        await BrowserOptimizations.setup_viewport_optimization(
-            page, options.get('viewport', None)
+        # Set default timeout to a higher value for complex sites
+        page.set_default_timeout(60000)
+        
+        # The remaining steps are independent, so their CDP round-trips overlap
+        await asyncio.gather(
+            BrowserOptimizations.setup_request_interception(
+                page, options.get('block_resources', [])
+            ),
+            BrowserOptimizations.setup_viewport_optimization(
+                page, options.get('viewport', None)
+            ),
         )
         
         return page
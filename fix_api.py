@@ -7,26 +7,49 @@ This script adds proper CORS headers and ensures all API responses are in JSON f
 import os
 import sys
 from flask import Flask, request, jsonify, render_template, send_file, Response, make_response
-from flask_cors import CORS
 import logging
 
+# CORS headers added to every API response
+_API_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+)
+
 # Add this to the top of app.py
 def create_app():
     app = Flask(__name__)
-    CORS(app)  # Enable CORS for all routes
     
     # Configure logging
-    logging.basicConfig(level=logging.DEBUG)
+    # Only the app logger runs at DEBUG; records from Flask, Werkzeug and
+    # other libraries below WARNING are not formatted per request
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
     logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    
+    # Answer CORS preflight requests for existing API routes before the views
+    # run; any other OPTIONS request gets Flask's normal handling
+    @app.before_request
+    def handle_preflight():
+        if request.method != 'OPTIONS' or request.path[:5] != '/api/':
+            return None
+        method = request.headers.get('Access-Control-Request-Method')
+        rule = request.url_rule
+        if method and rule is not None and method in rule.methods:
+            return Response(status=204)
+        return None
     
     # Add a middleware to ensure all API responses have proper headers
     @app.after_request
     def add_header(response):
-        if request.path.startswith('/api/'):
-            response.headers['Content-Type'] = 'application/json'
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        if request.path[:5] != '/api/':
+            return response
+        h = response.headers
+        # Keep a Content-Type the view already chose (e.g. jsonify's)
+        h.setdefault('Content-Type', 'application/json')
+        h.update(_API_HEADERS)
         return response
     
     return app, logger
@@ -41,14 +64,12 @@ def create_app():
    - Handle exceptions properly and return JSON error messages
    - Set appropriate status codes for errors
 
-3. Install flask-cors:
-   pip install flask-cors
+3. Remove any CORS(app) call; create_app() sets the CORS headers itself
 
 4. Restart the service after making changes
 """
 
 print("To fix the API response format issue:")
-print("1. Install flask-cors: pip install flask-cors")
-print("2. Modify app.py to use the create_app() function")
-print("3. Ensure all API endpoints return proper JSON responses")
-print("4. Restart the service")
+print("1. Modify app.py to use the create_app() function")
+print("2. Ensure all API endpoints return proper JSON responses")
+print("3. Restart the service")
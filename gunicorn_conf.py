@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Gunicorn Configuration
+Production server settings for the Flask services, used instead of the
+Werkzeug development server started by app.run().
+
+    gunicorn app_fixed:app -c gunicorn_conf.py
+    gunicorn simple_headless_fixed:app -c gunicorn_conf.py
+"""
+
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+
+# The apps are WSGI, so threads rather than an ASGI worker. Each request
+# thread hands its Playwright calls to the worker's browser loop.
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# Sessions, clients and the screencast live in process memory, so every
+# worker is its own independent service. Only raise this behind a proxy
+# that keeps each client on the same worker.
+workers = int(os.environ.get('WEB_WORKERS', 1))
+
+# Import the app in each worker, so each one starts its own browser after
+# the fork instead of inheriting the master's
+preload_app = False
+
+# MJPEG viewers keep a connection open; let them close on shutdown
+graceful_timeout = 10
+keepalive = 5
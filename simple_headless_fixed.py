@@ -5,65 +5,244 @@ A simplified version that focuses on core functionality with proper API response
 """
 
 import asyncio
-import base64
 import json
 import os
 import sys
-from flask import Flask, request, jsonify, render_template, send_file, Response
+import threading
+import time
+import uuid
+import orjson
+from flask import Flask, request, render_template, send_file, Response, g
 from flask_cors import CORS
-import nest_asyncio
-from playwright.async_api import async_playwright
+from playwright.async_api import Error as PlaywrightError
 
-# Apply nest_asyncio to allow asyncio to work in Flask
-nest_asyncio.apply()
+from browser_manager import get_browser, release_browser
 
-# Create Flask app with CORS support
+# SIMD base64 when available, same API as the stdlib module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Create Flask app with CORS support; flask-cors also answers the API's
+# preflight requests. Every view sets its own Content-Type.
 app = Flask(__name__)
-CORS(app)
+CORS(app, resources={r"/api/*": {
+    "origins": "*",
+    "methods": ["GET", "POST", "OPTIONS"],
+    "allow_headers": ["Content-Type"],
+}})
 
 # Global variables
-playwright = None
 browser = None
-context = None
-page = None
-loop = None
+clients = {}  # Client id (cookie) -> (context, page)
+client_seen = {}  # Client id -> time.monotonic() of its last request
+clients_lock = None  # Created on the loop so it is bound to it
+CLIENT_COOKIE = 'hb_client'
+browser_ready = threading.Event()  # Set once the warm-up launch has finished
+POOL_SIZE = min((os.cpu_count() or 1) * 2, 16)
+ACQUIRE_TIMEOUT = 30  # Seconds a new client waits for a free context
+CLIENT_IDLE_TIMEOUT = 600  # Idle clients lose their context once the pool runs dry
+VIEWPORT = {'width': 1024, 'height': 768}  # Smaller than Chromium's default, so captures encode faster
+
+# Page helpers installed in every document by an init script, so the fixed
+# snippets are a short call instead of new source for V8 to compile. The
+# binding is frozen and non-writable so a page cannot swap in its own
+# helpers and spoof what the API reports.
+_HB_HELPERS = """{
+    meta: () => ({title: document.title, url: location.href}),
+    content: () => ({
+        title: document.title,
+        text: document.body.innerText,
+        html: document.documentElement.outerHTML
+    })
+}"""
+_HB_INIT_JS = f"""Object.defineProperty(window, '__hb', {{
+    value: Object.freeze({_HB_HELPERS}),
+    writable: false,
+    configurable: false
+}});"""
+
+# Call a page helper; documents without __hb (e.g. the initial about:blank)
+# get the full snippet instead. Any other page error is raised as is.
+async def call_helper(page, name):
+    try:
+        return await page.evaluate(f"__hb.{name}()")
+    except PlaywrightError as e:
+        if "__hb is not defined" not in str(e):
+            raise
+    return await page.evaluate(f"({_HB_HELPERS}).{name}()")
+
+# Fixed set of contexts created up front and handed out to clients, so a
+# burst of clients queues up instead of overwhelming Chromium
+class ContextPool:
+    def __init__(self, size):
+        self.size = size
+        self.browser = None
+        self.queue = None
+        self._refills = set()  # Keeps background refill tasks referenced
+    
+    async def _new_context(self):
+        context = await self.browser.new_context(viewport=VIEWPORT)
+        await context.add_init_script(_HB_INIT_JS)
+        return context
+    
+    async def init(self, browser):
+        self.browser = browser
+        queue = asyncio.Queue()
+        for context in await asyncio.gather(*(self._new_context() for _ in range(self.size))):
+            queue.put_nowait(context)
+        self.queue = queue
+    
+    async def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("No browser context available, try again later")
+    
+    async def release(self, context):
+        # Each context serves one client, so it is never handed on: closing
+        # it drops storage, cache, service workers and permissions along with
+        # the cookies. The replacement is created in the background.
+        task = asyncio.get_running_loop().create_task(self._refill(context))
+        self._refills.add(task)
+        task.add_done_callback(self._refills.discard)
+    
+    def return_unused(self, context):
+        # A context no client has opened a page in can go straight back
+        self.queue.put_nowait(context)
+    
+    async def _refill(self, context):
+        try:
+            await context.close()
+        except Exception:
+            pass
+        try:
+            self.queue.put_nowait(await self._new_context())
+        except Exception as e:
+            print(f"Could not replace pooled context: {str(e)}")
+
+pool = ContextPool(POOL_SIZE)
 
 # Initialize the browser
 async def init_browser():
-    global playwright, browser, context, page
-    playwright = await async_playwright().start()
-    browser = await playwright.chromium.launch(headless=True)
-    context = await browser.new_context()
-    page = await context.new_page()
+    global browser, clients_lock
+    if browser is None:
+        # Skip sandbox and GPU setup that a server has no use for
+        shared = await get_browser(
+            args=('--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu'))
+        clients_lock = asyncio.Lock()
+        try:
+            await pool.init(shared)
+        except Exception:
+            # The retry from /api/start takes a new reference
+            await release_browser(shared)
+            raise
+        # Only published once the pool is ready, so a failed init is retried
+        browser = shared
     return True
 
-# Create a single event loop for all async operations
-def get_event_loop():
-    global loop
-    if loop is None:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop
+# Get the client's page, giving each client its own context from the pool
+async def open_client_page(client_id):
+    client_seen[client_id] = time.monotonic()
+    async with clients_lock:
+        entry = clients.get(client_id)
+    if entry is not None:
+        return entry[1]
+    
+    # Clients that never called /api/close would otherwise hold their
+    # contexts forever
+    if pool.queue.empty():
+        cutoff = time.monotonic() - CLIENT_IDLE_TIMEOUT
+        for idle_id in [c for c in clients if client_seen.get(c, 0) < cutoff]:
+            await close_client(idle_id)
+    
+    # Wait for a context without holding the lock
+    try:
+        context = await pool.acquire()
+    except RuntimeError:
+        client_seen.pop(client_id, None)
+        raise
+    async with clients_lock:
+        entry = clients.get(client_id)
+        if entry is None:
+            entry = clients[client_id] = (context, await context.new_page())
+            context = None
+    if context is not None:
+        # A concurrent request for the same client won the race
+        pool.return_unused(context)
+    return entry[1]
+
+# Release the client's context back to the pool
+async def close_client(client_id):
+    async with clients_lock:
+        entry = clients.pop(client_id, None)
+        client_seen.pop(client_id, None)
+    if entry is not None:
+        context, page = entry
+        await page.close()
+        await pool.release(context)
+
+# Navigate and read back the title and final URL in a single evaluate; without
+# the title the goto response already has the URL
+async def goto_page(page, url, include_title=True):
+    response = await page.goto(url)
+    if not include_title:
+        return {"url": response.url if response else page.url}
+    return await call_helper(page, 'meta')
+
+# Run a single event loop on a background thread; every Playwright object is
+# created and used on it
+loop = asyncio.new_event_loop()
+
+def _run_loop():
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+threading.Thread(target=_run_loop, daemon=True).start()
 
 # Run async function in the shared event loop
 def run_async(coro):
-    return get_event_loop().run_until_complete(coro)
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+# Serialize obj with orjson into a JSON response
+def ojson(obj):
+    return Response(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype='application/json')
+
+# Parse the request's JSON body with orjson, without caching the raw data;
+# a missing or malformed body reads as empty
+def _body():
+    if not request.content_length:
+        return {}
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+# Optional screenshot region from the request body, in CSS pixels
+def _clip(data):
+    clip = data.get('clip')
+    if clip is None:
+        return None
+    try:
+        return {key: float(clip[key]) for key in ('x', 'y', 'width', 'height')}
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("clip needs numeric x, y, width and height")
+
+# Page of the requesting client; new clients get an id cookie on the response
+def client_page():
+    client_id = request.cookies.get(CLIENT_COOKIE)
+    if client_id is None:
+        client_id = g.new_client_id = uuid.uuid4().hex
+    return run_async(open_client_page(client_id))
 
-# Ensure all API responses are JSON
 @app.after_request
-def add_header(response):
-    if request.path.startswith('/api/'):
-        response.headers['Content-Type'] = 'application/json'
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+def set_client_cookie(response):
+    if 'new_client_id' in g:
+        response.set_cookie(CLIENT_COOKIE, g.new_client_id, httponly=True, samesite='Lax')
     return response
 
-# Handle OPTIONS requests
-@app.route('/api/<path:path>', methods=['OPTIONS'])
-def options_handler(path):
-    return jsonify({"success": True})
-
 @app.route('/')
 def index():
     return render_template('simple.html')
@@ -71,189 +250,122 @@ def index():
 @app.route('/api/start', methods=['POST'])
 def start_browser():
     try:
+        # The browser is launched at import; this only waits for it to be ready
+        if not browser_ready.wait(timeout=60):
+            return ojson({"success": False, "error": "Browser is still starting"})
+        
+        # Retry if the warm-up launch failed
         success = run_async(init_browser())
-        return jsonify({"success": success, "message": "Browser started"})
+        return ojson({"success": success, "message": "Browser started"})
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return ojson({"success": False, "error": str(e)})
 
 @app.route('/api/navigate', methods=['POST'])
 def navigate():
     try:
-        data = request.json
+        data = _body()
         url = data.get('url', 'https://example.com')
         
-        if not page:
-            return jsonify({"success": False, "error": "Browser not started"})
+        if not browser:
+            return ojson({"success": False, "error": "Browser not started"})
+        page = client_page()
         
-        run_async(page.goto(url))
-        title = run_async(page.title())
+        result = run_async(goto_page(page, url, data.get('includeTitle', True)))
         
-        return jsonify({
-            "success": True, 
-            "url": url,
-            "title": title
-        })
+        return ojson({"success": True, **result})
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return ojson({"success": False, "error": str(e)})
 
 @app.route('/api/screenshot', methods=['POST'])
 def take_screenshot():
     try:
-        if not page:
-            return jsonify({"success": False, "error": "Browser not started"})
+        if not browser:
+            return ojson({"success": False, "error": "Browser not started"})
+        clip = _clip(_body())
+        page = client_page()
         
-        screenshot_bytes = run_async(page.screenshot())
-        screenshot_base64 = base64.b64encode(screenshot_bytes).decode('utf-8')
+        # JPEG is several times smaller than PNG before the base64 inflation
+        screenshot_bytes = run_async(page.screenshot(type='jpeg', quality=75, clip=clip))
+        screenshot_base64 = base64.b64encode(screenshot_bytes).decode('ascii')
         
-        return jsonify({
+        return ojson({
             "success": True,
-            "screenshot": screenshot_base64
+            "screenshot": screenshot_base64,
+            "format": "jpeg"
         })
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return ojson({"success": False, "error": str(e)})
+
+@app.route('/api/screenshot.png', methods=['POST'])
+def take_screenshot_png():
+    try:
+        if not browser:
+            return ojson({"success": False, "error": "Browser not started"})
+        clip = _clip(_body())
+        page = client_page()
+        
+        return Response(run_async(page.screenshot(type='png', clip=clip)), mimetype='image/png',
+                        headers={'Cache-Control': 'no-store'})
+    except Exception as e:
+        return ojson({"success": False, "error": str(e)})
 
 @app.route('/api/content', methods=['POST'])
 def get_content():
     try:
-        if not page:
-            return jsonify({"success": False, "error": "Browser not started"})
+        if not browser:
+            return ojson({"success": False, "error": "Browser not started"})
+        page = client_page()
         
-        content = run_async(page.content())
-        text = run_async(page.evaluate("() => document.body.innerText"))
-        title = run_async(page.title())
+        # One round-trip for everything instead of three
+        content = run_async(call_helper(page, 'content'))
         
-        return jsonify({
-            "success": True,
-            "title": title,
-            "text": text,
-            "html": content
-        })
+        return ojson({"success": True, **content})
+    except Exception as e:
+        return ojson({"success": False, "error": str(e)})
+
+@app.route('/api/close', methods=['POST'])
+def close_session():
+    try:
+        client_id = request.cookies.get(CLIENT_COOKIE)
+        if client_id and browser:
+            run_async(close_client(client_id))
+        
+        response = ojson({"success": True, "message": "Session closed"})
+        response.delete_cookie(CLIENT_COOKIE)
+        return response
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return ojson({"success": False, "error": str(e)})
 
 @app.route('/api/execute', methods=['POST'])
 def execute_js():
     try:
-        data = request.json
+        data = _body()
         script = data.get('script', 'document.title')
         
-        if not page:
-            return jsonify({"success": False, "error": "Browser not started"})
+        if not browser:
+            return ojson({"success": False, "error": "Browser not started"})
+        page = client_page()
         
         result = run_async(page.evaluate(script))
         
-        return jsonify({
+        return ojson({
             "success": True,
             "result": result
         })
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return ojson({"success": False, "error": str(e)})
+
+# Launch the browser in the background so the first request does not pay for it
+def warm_browser():
+    try:
+        run_async(init_browser())
+    except Exception as e:
+        print(f"Browser warm-up failed: {str(e)}")
+    finally:
+        browser_ready.set()
+
+threading.Thread(target=warm_browser, daemon=True).start()
 
 if __name__ == '__main__':
-    # Create templates directory if it doesn't exist
-    os.makedirs('templates', exist_ok=True)
-    
-    # Create a simple HTML template
-    with open('templates/simple.html', 'w') as f:
-        f.write("""<!DOCTYPE html>
-<html>
-<head>
-    <title>Simple Headless Browser</title>
-    <style>
-        body { font-family: Arial, sans-serif; margin: 20px; }
-        .container { max-width: 800px; margin: 0 auto; }
-        button { padding: 8px 16px; margin: 5px; }
-        input { padding: 8px; width: 300px; }
-        #screenshot { max-width: 100%; border: 1px solid #ccc; margin-top: 20px; }
-        #output { white-space: pre-wrap; background: #f5f5f5; padding: 10px; margin-top: 20px; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Simple Headless Browser</h1>
-        
-        <div>
-            <button id="startBtn">Start Browser</button>
-        </div>
-        
-        <div>
-            <input id="urlInput" type="text" placeholder="https://example.com" value="https://example.com">
-            <button id="navigateBtn">Navigate</button>
-        </div>
-        
-        <div>
-            <button id="screenshotBtn">Take Screenshot</button>
-            <button id="contentBtn">Get Content</button>
-        </div>
-        
-        <div>
-            <input id="jsInput" type="text" placeholder="JavaScript code" value="document.title">
-            <button id="executeBtn">Execute</button>
-        </div>
-        
-        <img id="screenshot" style="display: none;">
-        <pre id="output"></pre>
-    </div>
-    
-    <script>
-        // Helper function for API calls
-        async function callApi(endpoint, data = {}) {
-            try {
-                const response = await fetch(`/api/${endpoint}`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify(data)
-                });
-                
-                return await response.json();
-            } catch (error) {
-                console.error('API Error:', error);
-                return { success: false, error: error.message };
-            }
-        }
-        
-        // Display output
-        function showOutput(data) {
-            document.getElementById('output').textContent = JSON.stringify(data, null, 2);
-        }
-        
-        // Event listeners
-        document.getElementById('startBtn').addEventListener('click', async () => {
-            const result = await callApi('start');
-            showOutput(result);
-        });
-        
-        document.getElementById('navigateBtn').addEventListener('click', async () => {
-            const url = document.getElementById('urlInput').value;
-            const result = await callApi('navigate', { url });
-            showOutput(result);
-        });
-        
-        document.getElementById('screenshotBtn').addEventListener('click', async () => {
-            const result = await callApi('screenshot');
-            if (result.success) {
-                const img = document.getElementById('screenshot');
-                img.src = `data:image/png;base64,${result.screenshot}`;
-                img.style.display = 'block';
-            }
-            showOutput(result);
-        });
-        
-        document.getElementById('contentBtn').addEventListener('click', async () => {
-            const result = await callApi('content');
-            showOutput(result);
-        });
-        
-        document.getElementById('executeBtn').addEventListener('click', async () => {
-            const script = document.getElementById('jsInput').value;
-            const result = await callApi('execute', { script });
-            showOutput(result);
-        });
-    </script>
-</body>
-</html>""")
-    
     # Run the app
-    app.run(host='0.0.0.0', port=8081, debug=False)
+    app.run(host='0.0.0.0', port=8081, debug=False, threaded=True)
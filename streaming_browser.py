@@ -9,20 +9,29 @@ import base64
 import io
 import json
 import os
+import socket
 import sys
 import time
 import threading
+import zlib
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template, Response, send_file
+import orjson
+from flask import Flask, request, jsonify, Response, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-import nest_asyncio
 from playwright.async_api import async_playwright
 
-# Apply nest_asyncio to allow asyncio to work in Flask
-nest_asyncio.apply()
+# Serialize jsonify() responses and parse request bodies with orjson
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Create Flask app with CORS support
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Global variables
@@ -30,39 +39,60 @@ playwright = None
 browser = None
 context = None
 page = None
-loop = None
+cdp = None
 streaming_active = False
 stream_fps = 30  # Default FPS
 stream_quality = 80  # Default JPEG quality (0-100)
-last_screenshot = None
-screenshot_lock = threading.Lock()
+# (sequence number, MJPEG part) for the latest frame, shared by all clients;
+# swapped as one tuple so readers never see a blob from another frame
+latest_frame = (0, None)
+pending_ack = None  # Screencast sessionId of the latest frame until a client sends it
+last_frame_crc = None  # CRC32 of the latest JPEG, to drop repeated frames
+browser_ready = threading.Event()  # Set once the warm-up launch has finished
+frame_cond = threading.Condition()  # Notified when a new frame arrives
+
+# Opt-in GPU rasterization and encoding (BROWSER_GPU=1); only useful on hosts
+# with a working GPU stack, elsewhere Chromium falls back to software
+GPU_ARGS = [
+    "--enable-features=AcceleratedJpegEncoding,VaapiVideoEncoder",
+    "--use-gl=egl",
+    "--enable-gpu-rasterization",
+    "--ignore-gpu-blocklist",
+]
 
 # Initialize the browser
 async def init_browser():
-    global playwright, browser, context, page
+    global playwright, browser, context, page, cdp
     playwright = await async_playwright().start()
-    browser = await playwright.chromium.launch(headless=True)
+    args = GPU_ARGS if os.environ.get("BROWSER_GPU") else []
+    browser = await playwright.chromium.launch(headless=True, args=args)
     context = await browser.new_context(viewport={"width": 1280, "height": 720})
     page = await context.new_page()
+    # One CDP session serves both the screencast and single screenshots
+    cdp = await context.new_cdp_session(page)
+    cdp.on("Page.screencastFrame", on_screencast_frame)
     return True
 
-# Create a single event loop for all async operations
-def get_event_loop():
-    global loop
-    if loop is None:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop
+# Run a single event loop on a background thread so CDP events (screencast
+# frames) are dispatched between requests
+loop = asyncio.new_event_loop()
+
+def _run_loop():
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+threading.Thread(target=_run_loop, daemon=True).start()
 
 # Run async function in the shared event loop
 def run_async(coro):
-    return get_event_loop().run_until_complete(coro)
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
 
 # Ensure all API responses are JSON
 @app.after_request
 def add_header(response):
     if request.path.startswith('/api/') and not request.path.startswith('/api/stream'):
-        response.headers['Content-Type'] = 'application/json'
+        # Keep binary bodies (e.g. /api/screenshot?binary=1) as they are
+        response.headers.setdefault('Content-Type', 'application/json')
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
@@ -73,58 +103,129 @@ def add_header(response):
 def options_handler(path):
     return jsonify({"success": True})
 
-# Screenshot capture thread
-def screenshot_capture_thread():
-    global last_screenshot, streaming_active
+# Store each screencast frame; the ack is held back until a client has sent it,
+# so Chromium captures no faster than the viewers consume
+def on_screencast_frame(params):
+    global latest_frame, pending_ack, last_frame_crc
     
-    while streaming_active:
-        try:
-            if page:
-                # Capture screenshot with specified quality
-                screenshot_bytes = run_async(page.screenshot(type='jpeg', quality=stream_quality))
-                
-                # Update the last screenshot with thread safety
-                with screenshot_lock:
-                    last_screenshot = screenshot_bytes
-                
-                # Calculate sleep time to maintain target FPS
-                sleep_time = 1.0 / stream_fps
-                time.sleep(sleep_time)
-            else:
-                time.sleep(0.1)  # Sleep briefly if page is not available
-        except Exception as e:
-            print(f"Screenshot error: {str(e)}")
-            time.sleep(0.5)  # Sleep on error to prevent CPU spinning
+    jpeg_bytes = base64.b64decode(params["data"])
+    
+    # An identical frame would only wake every client to resend the same
+    # image; ack it straight away so the screencast keeps going
+    crc = zlib.crc32(jpeg_bytes)
+    if crc == last_frame_crc:
+        send_frame_ack(params["sessionId"])
+        return
+    last_frame_crc = crc
+    
+    # Wrap the frame once here rather than once per client
+    blob = (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n%s\r\n'
+            % (len(jpeg_bytes), jpeg_bytes))
+    with frame_cond:
+        latest_frame = (latest_frame[0] + 1, blob)
+        pending_ack = params["sessionId"]
+        frame_cond.notify_all()
+
+def send_frame_ack(session_id):
+    asyncio.ensure_future(cdp.send("Page.screencastFrameAck", {"sessionId": session_id}))
+
+# Start (or restart with new settings) the CDP screencast; frames are pushed
+# by the renderer only when the page changes
+async def start_screencast():
+    global pending_ack, last_frame_crc
+    
+    # Stopping first is a no-op when no screencast is running
+    await cdp.send("Page.stopScreencast")
+    with frame_cond:
+        pending_ack = None
+    last_frame_crc = None
+    
+    viewport = page.viewport_size or {}
+    await cdp.send("Page.startScreencast", {
+        "format": "jpeg",
+        "quality": stream_quality,
+        "maxWidth": viewport.get("width", 1280),
+        "maxHeight": viewport.get("height", 720),
+        "everyNthFrame": max(1, 60 // stream_fps)
+    })
+
+async def stop_screencast():
+    if cdp is not None:
+        await cdp.send("Page.stopScreencast")
 
 # Generate frames for MJPEG stream
 def generate_frames():
-    global last_screenshot
+    global pending_ack
+    last_seen = 0
+    next_deadline = time.monotonic()
     
-    while True:
-        with screenshot_lock:
-            if last_screenshot:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + last_screenshot + b'\r\n')
-        
-        # Sleep to control server load
-        time.sleep(0.01)
+    # End the response once streaming stops so the worker thread is freed
+    while streaming_active:
+        # latest_frame is rebound as a whole, so a slow client that is
+        # already behind can take the newest frame without the lock
+        seq, blob = latest_frame
+        if seq == last_seen:
+            # Block until a frame this client has not sent yet arrives; the
+            # timeout bounds how long a stopped stream can go unnoticed
+            with frame_cond:
+                ready = frame_cond.wait_for(
+                    lambda: not streaming_active or latest_frame[0] != last_seen,
+                    timeout=1.0)
+                if not ready or not streaming_active:
+                    continue
+                seq, blob = latest_frame
+        last_seen = seq
+        
+        # Write outside the lock so a slow client cannot hold up the others
+        yield blob
+        
+        # Hold to the target FPS against a monotonic schedule, so write time
+        # doesn't add drift; a client that fell behind restarts the schedule
+        next_deadline += 1.0 / stream_fps
+        delay = next_deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_deadline = time.monotonic()
+        
+        # The first client to finish writing this frame releases the next one,
+        # after the pacing above, so Chromium captures at the target FPS
+        with frame_cond:
+            session_id, pending_ack = pending_ack, None
+        if session_id is not None:
+            loop.call_soon_threadsafe(send_frame_ack, session_id)
+
+# The page is static, so it is read once (on first request, after __main__
+# has written the template) and served without going through Jinja
+_index_html = None
 
 @app.route('/')
 def index():
-    return render_template('streaming.html')
+    global _index_html
+    if _index_html is None:
+        with open(os.path.join(app.root_path, app.template_folder, 'streaming.html'), 'rb') as f:
+            _index_html = f.read()
+    return Response(_index_html, mimetype='text/html')
 
 @app.route('/api/start', methods=['POST'])
 def start_browser():
     try:
-        success = run_async(init_browser())
-        return jsonify({"success": success, "message": "Browser started"})
+        # The browser is launched at import; this only waits for it to be ready
+        if not browser_ready.wait(timeout=60):
+            return jsonify({"success": False, "error": "Browser is still starting"})
+        
+        # Retry if the warm-up launch failed
+        if not page:
+            run_async(init_browser())
+        
+        return jsonify({"success": True, "message": "Browser started"})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/api/navigate', methods=['POST'])
 def navigate():
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         url = data.get('url', 'https://example.com')
         
         if not page:
@@ -147,11 +248,21 @@ def take_screenshot():
         if not page:
             return jsonify({"success": False, "error": "Browser not started"})
         
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         quality = data.get('quality', 80)
         
-        screenshot_bytes = run_async(page.screenshot(type='jpeg', quality=quality))
-        screenshot_base64 = base64.b64encode(screenshot_bytes).decode('utf-8')
+        # CDP already returns base64, so there is nothing to re-encode
+        screenshot_base64 = run_async(cdp.send("Page.captureScreenshot", {
+            "format": "jpeg",
+            "quality": quality,
+            "optimizeForSpeed": True,
+            "captureBeyondViewport": False
+        }))["data"]
+        
+        # Binary-capable clients get the raw JPEG, a third smaller than base64
+        if request.args.get('binary') == '1':
+            return Response(base64.b64decode(screenshot_base64), mimetype='image/jpeg',
+                            headers={'Cache-Control': 'no-store'})
         
         return jsonify({
             "success": True,
@@ -168,13 +279,12 @@ def start_streaming():
         if not page:
             return jsonify({"success": False, "error": "Browser not started"})
         
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         stream_fps = min(max(data.get('fps', 30), 1), 60)  # Limit FPS between 1-60
         stream_quality = min(max(data.get('quality', 80), 10), 100)  # Limit quality between 10-100
         
-        if not streaming_active:
-            streaming_active = True
-            threading.Thread(target=screenshot_capture_thread, daemon=True).start()
+        run_async(start_screencast())
+        streaming_active = True
         
         return jsonify({
             "success": True,
@@ -190,7 +300,13 @@ def stop_streaming():
     global streaming_active
     
     try:
+        if streaming_active:
+            run_async(stop_screencast())
         streaming_active = False
+        
+        # Wake waiting MJPEG clients so their responses end now
+        with frame_cond:
+            frame_cond.notify_all()
         return jsonify({
             "success": True,
             "message": "Streaming stopped"
@@ -203,7 +319,7 @@ def update_stream_settings():
     global stream_fps, stream_quality
     
     try:
-        data = request.json or {}
+        data = request.get_json(silent=True) or {}
         
         if 'fps' in data:
             stream_fps = min(max(data.get('fps'), 1), 60)  # Limit FPS between 1-60
@@ -211,6 +327,10 @@ def update_stream_settings():
         if 'quality' in data:
             stream_quality = min(max(data.get('quality'), 10), 100)  # Limit quality between 10-100
         
+        # The screencast only picks up new settings when restarted
+        if streaming_active:
+            run_async(start_screencast())
+        
         return jsonify({
             "success": True,
             "message": f"Stream settings updated: {stream_fps} FPS, quality {stream_quality}",
@@ -222,8 +342,20 @@ def update_stream_settings():
 
 @app.route('/api/stream/mjpeg')
 def mjpeg_stream():
-    return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+    # Send each frame as soon as it is written: no Nagle delay on the
+    # socket (the dev server exposes it) and no buffering in nginx
+    sock = request.environ.get('werkzeug.socket')
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+    
+    response = Response(generate_frames(),
+                        mimetype='multipart/x-mixed-replace; boundary=frame',
+                        direct_passthrough=True)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/content', methods=['POST'])
 def get_content():
@@ -231,15 +363,21 @@ def get_content():
         if not page:
             return jsonify({"success": False, "error": "Browser not started"})
         
-        content = run_async(page.content())
-        text = run_async(page.evaluate("() => document.body.innerText"))
-        title = run_async(page.title())
+        # Read everything in one CDP round-trip instead of three
+        result = run_async(cdp.send("Runtime.evaluate", {
+            "expression": "({title: document.title, text: document.body.innerText, "
+                          "html: document.documentElement.outerHTML})",
+            "returnByValue": True
+        }))
+        if "exceptionDetails" in result:
+            raise RuntimeError(result["exceptionDetails"].get("text", "Evaluation failed"))
+        content = result["result"]["value"]
         
         return jsonify({
             "success": True,
-            "title": title,
-            "text": text,
-            "html": content
+            "title": content["title"],
+            "text": content["text"],
+            "html": content["html"]
         })
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
@@ -247,7 +385,7 @@ def get_content():
 @app.route('/api/execute', methods=['POST'])
 def execute_js():
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         script = data.get('script', 'document.title')
         
         if not page:
@@ -265,7 +403,7 @@ def execute_js():
 @app.route('/api/click', methods=['POST'])
 def click_element():
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         selector = data.get('selector')
         
         if not page or not selector:
@@ -283,7 +421,7 @@ def click_element():
 @app.route('/api/type', methods=['POST'])
 def type_text():
     try:
-        data = request.json
+        data = request.get_json(silent=True) or {}
         selector = data.get('selector')
         text = data.get('text')
         
@@ -299,6 +437,17 @@ def type_text():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+# Launch the browser in the background so the first request does not pay for it
+def warm_browser():
+    try:
+        run_async(init_browser())
+    except Exception as e:
+        print(f"Browser warm-up failed: {str(e)}")
+    finally:
+        browser_ready.set()
+
+threading.Thread(target=warm_browser, daemon=True).start()
+
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
     os.makedirs('templates', exist_ok=True)